@@ -1,11 +1,19 @@
-import base64
+import asyncio
+import hashlib
 import os
 import logging
 import io
+import struct
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 
+from cachetools import LRUCache
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
+import numpy as np
+import pybase64
 import soundfile as sf
 import torch
 
@@ -22,45 +30,121 @@ app = FastAPI(
     version="2.0.0"
 )
 
+# --- Request Batching Configuration ---
+# Concurrent requests are pooled for up to MAX_WAIT_MS and run through the backbone together
+MAX_BATCH = int(os.getenv("MAX_BATCH", "8"))
+MAX_WAIT_MS = float(os.getenv("MAX_WAIT_MS", "8"))
+# Set NEUTTS_QUANT=int8 to quantize the backbone's Linear layers on CPU deployments
+NEUTTS_QUANT = os.getenv("NEUTTS_QUANT") or None
+# Path to a small distilled backbone sharing the tokenizer, used as a speculative decoding draft
+NEUTTS_DRAFT_MODEL = os.getenv("NEUTTS_DRAFT_MODEL") or None
+
+# --- Streaming Configuration ---
+# /generate-tts-file/ pulls codec hops on its own pool; each open stream holds a thread until it ends
+MAX_STREAMS = int(os.getenv("MAX_STREAMS", "4"))
+
+# --- Dynamic Voice Cache Configuration ---
+# Voices loaded from samples/ on demand are kept in a bounded LRU keyed by a hash of their audio
+VOICE_CACHE_CAPACITY = int(os.getenv("VOICE_CACHE_CAPACITY", "50"))
+VOICE_HASH_SAMPLE_BYTES = 256 * 1024
+# Transcripts for 3-15 s reference clips are far shorter; longer files are rejected before tokenization
+MAX_REFERENCE_TEXT_CHARS = 2000
+
+# --- Output Cache Configuration ---
+# Encoded WAVs for repeated (text, voice) requests are kept in an LRU bounded by total size; 0 disables it
+OUTPUT_CACHE_MB = int(os.getenv("OUTPUT_CACHE_MB", "256"))
+
+# --- Voice Selection Configuration ---
+# STRICT_VOICES=1 only accepts the preloaded voices; otherwise any samples/<name>.wav can be requested
+STRICT_VOICES = os.getenv("STRICT_VOICES") == "1"
+
 # --- Model Loading and Caching Logic ---
 device = "cuda" if torch.cuda.is_available() else "cpu"
-logging.info(f"Loading NeuTTSAir model on device: {device} ...")
+# Assisted generation needs the dynamic KV cache, so a draft model disables compilation
+compile_backbone = device == "cuda" and NEUTTS_DRAFT_MODEL is None
 
 # Normalize local model paths to absolute paths so transformers/huggingface_hub treats them as local folders
 backbone_local = os.path.abspath("neuttsair/local_models/backbone")
 codec_local = os.path.abspath("neuttsair/local_models/codec.pt")
-
-app_state["tts_model"] = NeuTTSAir(
-    backbone_repo=backbone_local,
-    codec_repo=codec_local,
-    backbone_device=device,
-    codec_device=device,
-)
-logging.info("Model loaded successfully.")
-
-# --- Pre-load and Cache Reference Voices ---
-logging.info("Pre-loading and caching reference voices...")
-app_state["cached_references"] = {}
+codec_decoder_local = os.path.abspath("neuttsair/local_models/codec_decoder")
 
 voice_types = {
     "MALE": {"audio": "samples/male.wav", "text": "samples/male.txt"},
     "FEMALE": {"audio": "samples/female.wav", "text": "samples/female.txt"}
 }
 
-for name, paths in voice_types.items():
-    if not os.path.exists(paths["audio"]) or not os.path.exists(paths["text"]):
-        logging.warning(f"Reference files for {name} not found. Skipping.")
-        continue
 
-    ref_text = open(paths["text"], "r").read().strip()
-    ref_codes = app_state["tts_model"].encode_reference(paths["audio"])
-    app_state["cached_references"][name] = {"text": ref_text, "codes": ref_codes}
-    logging.info(f"Successfully cached reference for voice: {name}")
+def read_reference_text(text_path: str) -> str:
+    """Read a reference transcript, rejecting it if it exceeds MAX_REFERENCE_TEXT_CHARS."""
+    # UTF-8 needs at most 4 bytes per character, so anything longer than that is over the limit
+    max_bytes = 4 * MAX_REFERENCE_TEXT_CHARS
+    with open(text_path, "rb") as f:
+        data = f.read(max_bytes + 1)
+    # Check the byte count first: the read may have cut a multi-byte character in half
+    if len(data) > max_bytes:
+        raise ValueError(f"Reference text '{text_path}' exceeds {MAX_REFERENCE_TEXT_CHARS} characters.")
+    ref_text = data.decode("utf-8").strip()
+    if len(ref_text) > MAX_REFERENCE_TEXT_CHARS:
+        raise ValueError(f"Reference text '{text_path}' exceeds {MAX_REFERENCE_TEXT_CHARS} characters.")
+    return ref_text
+
+
+def load_model():
+    """Load the TTS model and pre-cache the reference voices in `voice_types`.
+
+    Called from the startup hook so that importing this module stays cheap.
+    """
+    # Nothing here trains; the model methods also run under torch.inference_mode on worker threads
+    torch.set_grad_enabled(False)
+    if device == "cuda":
+        torch.backends.cudnn.benchmark = True
+
+    logging.info(f"Loading NeuTTSAir model on device: {device} ...")
+    app_state["tts_model"] = NeuTTSAir(
+        backbone_repo=backbone_local,
+        codec_repo=codec_local,
+        backbone_device=device,
+        codec_device=device,
+        # BF16 weights and a compiled decode step only pay off on CUDA; older CPUs regress with BF16
+        backbone_dtype=torch.bfloat16 if device == "cuda" else None,
+        compile_backbone=compile_backbone,
+        # The codec is small, so only the backbone is quantized
+        backbone_quantization=NEUTTS_QUANT if device == "cpu" else None,
+        # ONNX Runtime decodes faster than eager PyTorch on CPU; skip it if save_models.py didn't fetch it
+        codec_decoder_repo=codec_decoder_local if device == "cpu" and os.path.isdir(codec_decoder_local) else None,
+        draft_repo=NEUTTS_DRAFT_MODEL,
+    )
+    logging.info("Model loaded successfully.")
+
+    # --- Pre-load and Cache Reference Voices ---
+    logging.info("Pre-loading and caching reference voices...")
+    app_state["cached_references"] = {}
+    # Dynamic voices being encoded, so concurrent requests for a new voice encode it once
+    app_state["pending_references"] = {}
+    # Guards pending_references only; never held while the model runs
+    app_state["references_lock"] = threading.Lock()
+
+    for name, paths in voice_types.items():
+        if not os.path.exists(paths["audio"]) or not os.path.exists(paths["text"]):
+            logging.warning(f"Reference files for {name} not found. Skipping.")
+            continue
+
+        ref_text = read_reference_text(paths["text"])
+        ref_codes = app_state["tts_model"].encode_reference(paths["audio"])
+        app_state["cached_references"][name] = {
+            "text": ref_text,
+            "codes": ref_codes,
+            "prefix_cache": app_state["tts_model"].build_prefix_cache(ref_text),
+            # Identifies the reference in the output cache
+            "cache_key": ("preloaded", name),
+        }
+        logging.info(f"Successfully cached reference for voice: {name}")
 
 # --- Pydantic Models ---
 class TTSRequest(BaseModel):
     text: str = Field(..., min_length=3, max_length=500, example="Hello, world. This is a test.")
     # voice_type may be any voice name (e.g. "MALE", "dave"); server will look for samples/<name>.wav and samples/<name>.txt
+    # With STRICT_VOICES=1 only the preloaded voices ("MALE", "FEMALE") are accepted
     voice_type: str = Field(..., example="MALE")
 
 
@@ -71,16 +155,71 @@ class TTSResponseBase64(BaseModel):
     # Optional warning when requested voice not found and fallback used
     warning: str | None = None
 
-# --- Helper Function for Inference ---
-def run_inference(text: str, voice_name: str):
-    """A helper function to run TTS inference and return audio data as bytes.
+# --- Helper Functions for Inference ---
+def _audio_digest(audio_path: str) -> str:
+    """Hash a sampled slice of the reference audio plus its size, so edited files get a new key."""
+    with open(audio_path, "rb") as f:
+        sample = f.read(VOICE_HASH_SAMPLE_BYTES)
+        size = os.fstat(f.fileno()).st_size
+    digest = hashlib.blake2b(sample, digest_size=16)
+    digest.update(size.to_bytes(8, "little"))
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=VOICE_CACHE_CAPACITY)
+def _encode_reference_cached(audio_digest: str, audio_path: str, ref_text: str):
+    tts_model = app_state["tts_model"]
+    ref_codes = tts_model.encode_reference(audio_path)
+    return {
+        "text": ref_text,
+        "codes": ref_codes,
+        "prefix_cache": tts_model.build_prefix_cache(ref_text),
+        "cache_key": (audio_digest, ref_text),
+    }
+
+
+def encode_ref(audio_path: str, text_path: str):
+    """Encode a reference voice from disk, reusing the LRU entry if the audio is unchanged.
+
+    Concurrent requests for the same uncached voice share one encode; other voices don't wait on it.
+    """
+    ref_text = read_reference_text(text_path)
+    key = (_audio_digest(audio_path), audio_path, ref_text)
+
+    # lru_cache lookups are thread-safe but concurrent misses would each encode, so the
+    # first caller for a key encodes it and later ones wait on its future
+    pending = app_state["pending_references"]
+    with app_state["references_lock"]:
+        future = pending.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = pending[key] = Future()
+
+    if is_owner:
+        try:
+            future.set_result(_encode_reference_cached(*key))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with app_state["references_lock"]:
+                del pending[key]
+    reference = future.result()
+
+    info = _encode_reference_cached.cache_info()
+    logging.info(f"Voice cache: hits={info.hits} misses={info.misses} size={info.currsize}/{info.maxsize}")
+    return reference
+
+
+def resolve_reference(voice_name: str):
+    """Find the cached reference to use for `voice_name`.
 
     Behavior:
-    - If `voice_name` matches a cached reference (case-insensitive), use it.
+    - If `voice_name` matches a preloaded reference (case-insensitive), use it.
+    - Else, if STRICT_VOICES is set, reject the request with a 404.
     - Else, check for `samples/{voice_name}.wav` and `samples/{voice_name}.txt`.
-      - If found, encode and cache that reference and use it.
+      - If found, encode it (or reuse it from the bounded voice LRU) and use it.
       - If not found, fall back to 'MALE' cached reference (if present) and return a warning.
-    Returns (audio_bytes, warning_str_or_None)
+    Returns (reference, warning_str_or_None)
     """
     tts_model = app_state.get("tts_model")
     cached_refs = app_state.get("cached_references")
@@ -94,6 +233,11 @@ def run_inference(text: str, voice_name: str):
     # Direct cached hit
     if requested in cached_refs:
         reference = cached_refs[requested]
+    elif STRICT_VOICES:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown voice '{voice_name}'. Available voices: {', '.join(cached_refs)}.",
+        )
     else:
         # Look for samples/<name>.wav and .txt (case-sensitive on Linux)
         audio_path = os.path.join("samples", f"{voice_name}.wav")
@@ -101,11 +245,7 @@ def run_inference(text: str, voice_name: str):
 
         if os.path.exists(audio_path) and os.path.exists(text_path):
             try:
-                ref_text = open(text_path, "r").read().strip()
-                ref_codes = tts_model.encode_reference(audio_path)
-                # Cache under upper-case key
-                cached_refs[requested] = {"text": ref_text, "codes": ref_codes}
-                reference = cached_refs[requested]
+                reference = encode_ref(audio_path, text_path)
             except Exception as e:
                 logging.error(f"Failed to encode dynamic reference '{voice_name}': {e}")
                 reference = None
@@ -120,29 +260,172 @@ def run_inference(text: str, voice_name: str):
         else:
             raise HTTPException(status_code=404, detail=f"Reference voice for '{voice_name}' not found and no MALE fallback available.")
 
+    return reference, warning
+
+
+async def get_reference(voice_name: str):
+    """Resolve `voice_name` via `resolve_reference` without blocking the event loop.
+
+    Preloaded voices are a plain dict lookup done in place. Anything else may hash and
+    encode audio from samples/, which runs on the loop's default executor so it never
+    queues behind inference.
+    """
+    cached_refs = app_state.get("cached_references") or {}
+    if app_state.get("tts_model") and voice_name.upper() in cached_refs:
+        return cached_refs[voice_name.upper()], None
+    return await asyncio.get_running_loop().run_in_executor(None, resolve_reference, voice_name)
+
+
+async def run_inference(text: str, voice_name: str):
+    """A helper function to run TTS inference and return WAV audio data.
+
+    The request is queued for the batch worker, which synthesizes it together with
+    any other requests for the same reference voice.
+    Returns (audio_buffer, warning_str_or_None), where audio_buffer is a read-only
+    memoryview over the encoded WAV (no copy of the encoded bytes is made).
+    Audio is cached per (text, resolved reference), so repeated requests skip synthesis;
+    fallback results are never cached.
+    """
+    reference, warning = await get_reference(voice_name)
+
+    output_cache = app_state.get("output_cache") if warning is None else None
+    cache_key = (text, reference["cache_key"])
+    if output_cache is not None and cache_key in output_cache:
+        logging.info(f"Output cache hit for voice '{voice_name}'")
+        return output_cache[cache_key], warning
+
+    loop = asyncio.get_running_loop()
+
+    future = loop.create_future()
+    await app_state["request_queue"].put((text, reference, future))
+
     try:
         logging.info(f"Running inference for voice '{voice_name}' (using cached key)")
-        wav = tts_model.infer(text, reference["codes"], reference["text"])
+        wav = await future
 
         buffer = io.BytesIO()
-        sf.write(buffer, wav, 24000, format='WAV')
-        buffer.seek(0)
+        sf.write(buffer, wav, 24000, subtype='PCM_16', format='WAV')
 
         logging.info("Inference successful.")
-        return buffer.read(), warning
+        audio = buffer.getbuffer().toreadonly()
+        if output_cache is not None and audio.nbytes <= output_cache.maxsize:
+            output_cache[cache_key] = audio
+        return audio, warning
 
     except Exception as e:
         logging.error(f"An error occurred during inference: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate audio due to an internal error.")
 
+
+def _wav_stream_header(sample_rate: int) -> bytes:
+    """RIFF header for 16-bit mono PCM of unknown length (streaming sizes set to 0xFFFFFFFF)."""
+    return (
+        b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+        + b"data" + struct.pack("<I", 0xFFFFFFFF)
+    )
+
+
+async def batch_worker():
+    """Drain the request queue and run the backbone on batches of pending requests.
+
+    Collects up to MAX_BATCH items (waiting at most MAX_WAIT_MS after the first one),
+    groups them by reference voice so they share the same prompt prefix, and resolves
+    each request's future with its waveform (or the error that item alone hit).
+    """
+    loop = asyncio.get_running_loop()
+    queue = app_state["request_queue"]
+    tts_model = app_state["tts_model"]
+
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + MAX_WAIT_MS / 1000
+        while len(batch) < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Requests for the same voice share one cached reference dict
+        groups = {}
+        for item in batch:
+            groups.setdefault(id(item[1]), []).append(item)
+
+        for items in groups.values():
+            texts = [text for text, _, _ in items]
+            reference = items[0][1]
+            logging.info(f"Running batched inference for {len(texts)} request(s)")
+            try:
+                wavs = await loop.run_in_executor(
+                    app_state["inference_executor"],
+                    tts_model.infer_batch,
+                    texts,
+                    reference["codes"],
+                    reference["text"],
+                    reference["prefix_cache"],
+                )
+            except Exception as e:
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, _, future), wav in zip(items, wavs):
+                if future.done():
+                    continue
+                if isinstance(wav, Exception):
+                    future.set_exception(wav)
+                else:
+                    future.set_result(wav)
+
+
+@app.on_event("startup")
+async def startup():
+    # A single model instance only ever runs one generation at a time (NeuTTSAir serializes
+    # generate calls), so every generate call runs on this one thread. torch keeps captured
+    # CUDA graphs per thread, so warmup, batches and streams must all share it.
+    app_state["inference_executor"] = ThreadPoolExecutor(max_workers=1)
+    app_state["stream_executor"] = ThreadPoolExecutor(max_workers=MAX_STREAMS)
+    load_model()
+    if compile_backbone and app_state["cached_references"]:
+        # Compile and capture the decode step's CUDA graph for every batch size the batch
+        # worker can form before the first request arrives; any one voice will do
+        reference = next(iter(app_state["cached_references"].values()))
+        await asyncio.get_running_loop().run_in_executor(
+            app_state["inference_executor"],
+            app_state["tts_model"].warmup,
+            reference["codes"],
+            reference["text"],
+            MAX_BATCH,
+        )
+    # Only touched from the event loop, so it needs no lock
+    app_state["output_cache"] = (
+        LRUCache(maxsize=OUTPUT_CACHE_MB * 1024 * 1024, getsizeof=lambda audio: audio.nbytes)
+        if OUTPUT_CACHE_MB > 0
+        else None
+    )
+    app_state["request_queue"] = asyncio.Queue()
+    app_state["batch_worker"] = asyncio.create_task(batch_worker())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app_state["batch_worker"].cancel()
+    app_state["inference_executor"].shutdown(wait=False, cancel_futures=True)
+    app_state["stream_executor"].shutdown(wait=False, cancel_futures=True)
+
 # --- API Endpoints ---
 @app.post("/generate-tts-base64/", response_model=TTSResponseBase64, tags=["TTS Generation"])
 async def generate_tts_base64(request: TTSRequest):
     """
     Accepts text and a voice type, returns the synthesized audio as a Base64 encoded string.
     """
-    audio_bytes, warning = run_inference(request.text, request.voice_type)
-    audio_base64 = base64.b64encode(audio_bytes).decode("utf-8")
+    audio_buffer, warning = await run_inference(request.text, request.voice_type)
+    # pybase64 uses SIMD kernels and reads the WAV buffer in place; base64 output is pure ASCII
+    audio_base64 = pybase64.b64encode(audio_buffer).decode("ascii")
 
     return TTSResponseBase64(
         audio_base64=audio_base64,
@@ -154,12 +437,54 @@ async def generate_tts_base64(request: TTSRequest):
 @app.post("/generate-tts-file/", response_class=StreamingResponse, tags=["TTS Generation"])
 async def generate_tts_file(request: TTSRequest):
     """
-    Accepts text and a voice type, returns the synthesized audio as a complete .wav file.
+    Accepts text and a voice type, streams the synthesized audio as a .wav file while it is generated.
     """
-    audio_bytes, warning = run_inference(request.text, request.voice_type)
+    loop = asyncio.get_running_loop()
+    reference, warning = await get_reference(request.voice_type)
+
+    # Set when the response ends for any reason (including client disconnect) to stop generation
+    stop_event = threading.Event()
+    frames = app_state["tts_model"].infer_stream(
+        request.text,
+        reference["codes"],
+        reference["text"],
+        reference["prefix_cache"],
+        stop_event,
+        app_state["inference_executor"],
+    )
+    stream_executor = app_state["stream_executor"]
+
+    # Pull the first codec hop before responding, so failures up to here still return a 500
+    logging.info(f"Streaming inference for voice '{request.voice_type}'")
+    try:
+        first_frame = await loop.run_in_executor(stream_executor, next, frames, None)
+    except Exception as e:
+        stop_event.set()
+        logging.error(f"An error occurred during streaming inference: {e}")
+        raise HTTPException(status_code=500, detail="Failed to generate audio due to an internal error.")
+
+    def to_pcm(frame):
+        return (np.clip(frame, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+    async def wav_chunks():
+        try:
+            yield _wav_stream_header(24000)
+            if first_frame is None:
+                return
+            yield to_pcm(first_frame)
+            # Codec hops are pulled on the stream pool, so open streams never hold up voice lookups
+            while (frame := await loop.run_in_executor(stream_executor, next, frames, None)) is not None:
+                yield to_pcm(frame)
+        except Exception as e:
+            # Headers are already sent; aborting the response tells the client the WAV is truncated
+            logging.error(f"An error occurred during streaming inference: {e}")
+            raise
+        finally:
+            stop_event.set()
+        logging.info("Streaming inference successful.")
 
     return StreamingResponse(
-        io.BytesIO(audio_bytes),
+        wav_chunks(),
         media_type="audio/wav",
         headers={"Content-Disposition": "attachment; filename=output.wav"}
     )
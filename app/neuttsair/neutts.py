@@ -1,5 +1,9 @@
-from typing import Generator
+from typing import Generator, Iterable
+from concurrent.futures import Executor
 from pathlib import Path
+from queue import Queue
+import copy
+import os
 import librosa
 import numpy as np
 import torch
@@ -7,8 +11,12 @@ import re
 import perth
 from neucodec import NeuCodec, DistillNeuCodec
 from phonemizer.backend import EspeakBackend
-from transformers import AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer
-from threading import Thread
+from transformers import AutoTokenizer, AutoModelForCausalLM, CompileConfig, StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+from threading import Event, RLock, Thread
+
+
+_CHAT_TEMPLATE = """user: Convert the text to speech:<|TEXT_REPLACE|>\nassistant:<|SPEECH_REPLACE|>"""
 
 
 def _linear_overlap_add(frames: list[np.ndarray], stride: int) -> np.ndarray:
@@ -37,6 +45,72 @@ def _linear_overlap_add(frames: list[np.ndarray], stride: int) -> np.ndarray:
     return out / sum_weight
 
 
+class _StopAfterNewTokens(StoppingCriteria):
+    """
+    Stops generation after `max_new_tokens` without changing `max_length`, which sizes the
+    static KV cache (and therefore the shapes the compiled decode step is captured for).
+    """
+
+    def __init__(self, prompt_length: int, max_new_tokens: int):
+        self.stop_length = prompt_length + max_new_tokens
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = input_ids.shape[-1] >= self.stop_length
+        return torch.full((input_ids.shape[0],), done, device=input_ids.device, dtype=torch.bool)
+
+
+class _StopOnEvent(StoppingCriteria):
+    """Stops generation once `event` is set, e.g. when the consumer of a stream goes away."""
+
+    def __init__(self, event: Event):
+        self.event = event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full(
+            (input_ids.shape[0],), self.event.is_set(), device=input_ids.device, dtype=torch.bool
+        )
+
+
+class _TokenIteratorStreamer(BaseStreamer):
+    """
+    Streamer that yields generated tokens one at a time as token strings.
+
+    TextIteratorStreamer holds text back until it sees whitespace, which speech tokens
+    never contain, so it would only release output once generation has finished.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.token_queue = Queue()
+        self.next_tokens_are_prompt = True
+
+    def put(self, value):
+        # The first call carries the prompt
+        if self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+        for token in self.tokenizer.convert_ids_to_tokens(value.reshape(-1).tolist()):
+            self.token_queue.put(token)
+
+    def end(self):
+        self.token_queue.put(None)
+
+    def error(self, exc: BaseException):
+        # Re-raised by the consumer, so a failed generation does not look like a finished one
+        self.token_queue.put(exc)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = self.token_queue.get()
+        if token is None:
+            raise StopIteration
+        if isinstance(token, BaseException):
+            raise token
+        return token
+
+
 class NeuTTSAir:
 
     def __init__(
@@ -45,6 +119,11 @@ class NeuTTSAir:
         codec_repo="neuttsair/local_models/codec.pt",
         backbone_device="cpu",
         codec_device="cpu",
+        backbone_dtype: torch.dtype | None = None,
+        compile_backbone=False,
+        backbone_quantization: str | None = None,
+        codec_decoder_repo=None,
+        draft_repo=None,
     ):
 
         # Consts
@@ -61,6 +140,16 @@ class NeuTTSAir:
         self._is_quantized_model = False
         self._is_onnx_codec = False
 
+        # Optional ONNX Runtime session for the codec decoder
+        self.codec_decoder = None
+
+        # Optional draft backbone for speculative decoding
+        self.draft = None
+
+        # The static KV cache and captured CUDA graphs live on the backbone itself, so
+        # generate calls on this instance must not overlap, whichever thread makes them
+        self._generate_lock = RLock()
+
         # HF tokenizer
         self.tokenizer = None
 
@@ -70,16 +159,39 @@ class NeuTTSAir:
             language="en-us", preserve_punctuation=True, with_stress=True
         )
 
-        self._load_backbone(backbone_repo, backbone_device)
+        self._load_backbone(
+            backbone_repo, backbone_device, backbone_dtype, compile_backbone, backbone_quantization
+        )
+
+        if draft_repo is not None:
+            if compile_backbone:
+                raise ValueError("Speculative decoding does not support the compiled static-cache backbone.")
+            self._load_draft(draft_repo, backbone_device, backbone_dtype, backbone_quantization)
 
         self._load_codec(codec_repo, codec_device)
 
+        if codec_decoder_repo is not None:
+            self._load_codec_decoder(codec_decoder_repo)
+
         # Load watermarker
         self.watermarker = perth.PerthImplicitWatermarker()
 
-    def _load_backbone(self, backbone_repo, backbone_device):
+    def _load_backbone(
+        self,
+        backbone_repo,
+        backbone_device,
+        backbone_dtype=None,
+        compile_backbone=False,
+        backbone_quantization=None,
+    ):
         """
         MODIFIED to load from a local path OR a Hugging Face repo.
+
+        `backbone_dtype` loads the weights in that dtype (e.g. torch.bfloat16 on CUDA).
+        `compile_backbone` switches generation to a static KV cache, which lets
+        `generate` compile the decode step with torch.compile(mode="reduce-overhead").
+        `backbone_quantization="int8"` applies dynamic INT8 weight quantization to the
+        backbone's Linear layers (CPU only).
         """
         print(f"Loading backbone from: {backbone_repo} on {backbone_device} ...")
 
@@ -90,8 +202,60 @@ class NeuTTSAir:
         else:
             # Load from a local directory instead of downloading
             self.tokenizer = AutoTokenizer.from_pretrained(backbone_repo)
-            self.backbone = AutoModelForCausalLM.from_pretrained(backbone_repo).to(
-                torch.device(backbone_device)
+            # safetensors are memory-mapped read-only, so worker processes loading the same
+            # files share the weight pages instead of each holding a private copy
+            self.backbone = AutoModelForCausalLM.from_pretrained(
+                backbone_repo,
+                torch_dtype=backbone_dtype,
+                low_cpu_mem_usage=True,
+                use_safetensors=True,
+                device_map={"": backbone_device},
+            )
+            self.backbone.eval().requires_grad_(False)
+            if compile_backbone:
+                # Wrapping the module in torch.compile would not reach generate(); a static
+                # cache keeps decode shapes fixed so generate compiles and graph-captures it.
+                self.backbone.generation_config.cache_implementation = "static"
+                self.backbone.generation_config.compile_config = CompileConfig(
+                    mode="reduce-overhead", fullgraph=False
+                )
+
+            match backbone_quantization:
+                case None:
+                    pass
+                case "int8":
+                    if backbone_device != "cpu":
+                        raise ValueError("Dynamic INT8 quantization only runs on CPU.")
+                    print("Quantizing backbone Linear layers to INT8...")
+                    torch.ao.quantization.quantize_dynamic(
+                        self.backbone, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+                    )
+                case _:
+                    raise ValueError("Invalid backbone quantization! Must be one of: None, 'int8'.")
+
+    def _load_draft(self, draft_repo, backbone_device, backbone_dtype=None, backbone_quantization=None):
+        """
+        Load a small draft model sharing the backbone's tokenizer. Single-sequence generation
+        passes it to `generate` as `assistant_model`: the draft proposes a block of tokens and
+        the backbone verifies them in one forward pass.
+        """
+        print(f"Loading draft model from: {draft_repo} on {backbone_device} ...")
+
+        self.draft = AutoModelForCausalLM.from_pretrained(
+            draft_repo,
+            torch_dtype=backbone_dtype,
+            low_cpu_mem_usage=True,
+            use_safetensors=True,
+            device_map={"": backbone_device},
+        )
+        self.draft.eval().requires_grad_(False)
+        # Codec token streams are repetitive enough that fixed blocks of 6 are usually accepted
+        self.draft.generation_config.num_assistant_tokens = 6
+        self.draft.generation_config.num_assistant_tokens_schedule = "constant"
+
+        if backbone_quantization == "int8":
+            torch.ao.quantization.quantize_dynamic(
+                self.draft, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
             )
 
     # ...existing code...
@@ -102,17 +266,20 @@ class NeuTTSAir:
         if str(codec_repo).endswith(".pt"):
             print("Detected local .pt file for codec. Loading from state_dict...")
             
-            state = torch.load(codec_repo, map_location=torch.device(codec_device))
+            # mmap + assign keeps the weights backed by the file's page cache, shared across workers
+            state = torch.load(
+                codec_repo, map_location=torch.device(codec_device), mmap=True, weights_only=True
+            )
             # Try loading into NeuCodec first, then DistillNeuCodec as a fallback
             load_error = None
             try:
                 self.codec = NeuCodec(sample_rate=self.sample_rate, hop_length=self.hop_length)
-                self.codec.load_state_dict(state)
+                self.codec.load_state_dict(state, assign=True)
             except Exception as e:
                 load_error = e
                 try:
                     self.codec = DistillNeuCodec(sample_rate=self.sample_rate, hop_length=self.hop_length)
-                    self.codec.load_state_dict(state)
+                    self.codec.load_state_dict(state, assign=True)
                     load_error = None
                 except Exception as e2:
                     load_error = e2
@@ -122,18 +289,18 @@ class NeuTTSAir:
                     "Failed to load codec state dict into NeuCodec or DistillNeuCodec"
                 ) from load_error
 
-            self.codec.eval().to(torch.device(codec_device))
+            self.codec.eval().requires_grad_(False).to(torch.device(codec_device))
             self._is_onnx_codec = False
             return
         
         match codec_repo:
             case "neuphonic/neucodec":
                 self.codec = NeuCodec.from_pretrained(codec_repo)
-                self.codec.eval().to(torch.device(codec_device))
+                self.codec.eval().requires_grad_(False).to(torch.device(codec_device))
                 self._is_onnx_codec = False
             case "neuphonic/distill-neucodec":
                 self.codec = DistillNeuCodec.from_pretrained(codec_repo)
-                self.codec.eval().to(torch.device(codec_device))
+                self.codec.eval().requires_grad_(False).to(torch.device(codec_device))
                 self._is_onnx_codec = False
             case "neuphonic/neucodec-onnx-decoder":
 
@@ -158,7 +325,44 @@ class NeuTTSAir:
                     " 'neuphonic/neucodec-onnx-decoder'."
                 )
 
-    def infer(self, text: str, ref_codes: np.ndarray | torch.Tensor, ref_text: str) -> np.ndarray:
+    def _load_codec_decoder(self, codec_decoder_repo):
+        """
+        Load an ONNX export of the codec decoder and decode speech tokens with ONNX Runtime.
+
+        The torch codec from `_load_codec` is still used to encode reference audio.
+        `codec_decoder_repo` may be an .onnx file or a directory containing one.
+        """
+        print(f"Loading ONNX codec decoder from: {codec_decoder_repo} ...")
+
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError(
+                "Failed to import onnxruntime. Ensure you have onnxruntime installed."
+            ) from e
+
+        decoder_path = Path(codec_decoder_repo)
+        if decoder_path.is_dir():
+            onnx_files = sorted(decoder_path.glob("**/*.onnx"))
+            if not onnx_files:
+                raise FileNotFoundError(f"No .onnx file found in {decoder_path}.")
+            decoder_path = onnx_files[0]
+
+        sess_options = onnxruntime.SessionOptions()
+        sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        sess_options.intra_op_num_threads = os.cpu_count()
+        self.codec_decoder = onnxruntime.InferenceSession(
+            str(decoder_path), sess_options=sess_options, providers=["CPUExecutionProvider"]
+        )
+        self._codec_decoder_input = self.codec_decoder.get_inputs()[0].name
+
+    def infer(
+        self,
+        text: str,
+        ref_codes: np.ndarray | torch.Tensor,
+        ref_text: str,
+        prefix_cache: dict | None = None,
+    ) -> np.ndarray:
         """
         Perform inference to generate speech from text using the TTS model and reference audio.
 
@@ -166,6 +370,8 @@ class NeuTTSAir:
             text (str): Input text to be converted to speech.
             ref_codes (np.ndarray | torch.tensor): Encoded reference.
             ref_text (str): Reference text for reference audio. Defaults to None.
+            prefix_cache (dict | None): Output of `build_prefix_cache(ref_text)`, reused to skip
+                prefilling the reference part of the prompt.
         Returns:
             np.ndarray: Generated speech waveform.
         """
@@ -175,15 +381,62 @@ class NeuTTSAir:
             output_str = self._infer_ggml(ref_codes, ref_text, text)
         else:
             prompt_ids = self._apply_chat_template(ref_codes, ref_text, text)
-            output_str = self._infer_torch(prompt_ids)
+            output_str = self._infer_torch(prompt_ids, prefix_cache)
 
         # Decode
         wav = self._decode(output_str)
         watermarked_wav = self.watermarker.apply_watermark(wav, sample_rate=24_000)
 
         return watermarked_wav
-    
-    def infer_stream(self, text: str, ref_codes: np.ndarray | torch.Tensor, ref_text: str) -> Generator[np.ndarray, None, None]:
+
+    def infer_batch(
+        self,
+        texts: list[str],
+        ref_codes: np.ndarray | torch.Tensor,
+        ref_text: str,
+        prefix_cache: dict | None = None,
+    ) -> list[np.ndarray | Exception]:
+        """
+        Perform batched inference for several texts that share the same reference audio.
+
+        Args:
+            texts (list[str]): Input texts to be converted to speech.
+            ref_codes (np.ndarray | torch.tensor): Encoded reference.
+            ref_text (str): Reference text for reference audio.
+            prefix_cache (dict | None): Output of `build_prefix_cache(ref_text)`. Only used for
+                batches of one, since left padding shifts the prefix in larger batches.
+        Returns:
+            list[np.ndarray | Exception]: Generated speech waveforms, in the same order as
+            `texts`. An item that failed to decode holds its exception instead.
+        """
+
+        # Generate tokens
+        if self._is_quantized_model:
+            output_strs = [self._infer_ggml(ref_codes, ref_text, text) for text in texts]
+        else:
+            prompts = [self._apply_chat_template(ref_codes, ref_text, text) for text in texts]
+            output_strs = self._infer_torch_batch(prompts, prefix_cache)
+
+        # Decode each item on its own, so one bad sample only fails its own request
+        wavs = []
+        for output_str in output_strs:
+            try:
+                wav = self._decode(output_str)
+                wavs.append(self.watermarker.apply_watermark(wav, sample_rate=24_000))
+            except Exception as e:
+                wavs.append(e)
+
+        return wavs
+
+    def infer_stream(
+        self,
+        text: str,
+        ref_codes: np.ndarray | torch.Tensor,
+        ref_text: str,
+        prefix_cache: dict | None = None,
+        stop_event: Event | None = None,
+        executor: Executor | None = None,
+    ) -> Generator[np.ndarray, None, None]:
         """
         Perform streaming inference to generate speech from text using the TTS model and reference audio.
 
@@ -191,6 +444,12 @@ class NeuTTSAir:
             text (str): Input text to be converted to speech.
             ref_codes (np.ndarray | torch.tensor): Encoded reference.
             ref_text (str): Reference text for reference audio. Defaults to None.
+            prefix_cache (dict | None): Output of `build_prefix_cache(ref_text)` (torch backend only).
+            stop_event (threading.Event | None): Set it to stop generation early, e.g. when the
+                client disconnects (torch backend only).
+            executor (concurrent.futures.Executor | None): Runs the backbone's generate call
+                (torch backend only). Pass the executor that runs the other generate calls, so
+                they share a thread and its captured CUDA graphs. Defaults to a new thread.
         Yields:
             np.ndarray: Generated speech waveform.
         """ 
@@ -199,14 +458,88 @@ class NeuTTSAir:
             return self._infer_stream_ggml(ref_codes, ref_text, text)
 
         else:
-            raise NotImplementedError("Streaming is not implemented for the torch backend!")
+            return self._infer_stream_torch(ref_codes, ref_text, text, prefix_cache, stop_event, executor)
 
     def encode_reference(self, ref_audio_path: str | Path):
         wav, _ = librosa.load(ref_audio_path, sr=16000, mono=True)
         wav_tensor = torch.from_numpy(wav).float().unsqueeze(0).unsqueeze(0)  # [1, 1, T]
-        with torch.no_grad():
+        with torch.inference_mode():
             ref_codes = self.codec.encode_code(audio_or_path=wav_tensor).squeeze(0).squeeze(0)
-        return ref_codes
+        # Codes are only ever read on the host (formatted into speech tokens), so copy them
+        # off the codec device once here instead of syncing per element on every request
+        return ref_codes.cpu()
+
+    def warmup(
+        self,
+        ref_codes: np.ndarray | torch.Tensor,
+        ref_text: str,
+        max_batch_size: int = 1,
+        n_tokens: int = 16,
+    ):
+        """
+        Run a short generation at every batch size from 1 to `max_batch_size` so that
+        compiling and CUDA-graph capturing the decode step (see `compile_backbone`), which
+        happens once per batch size, is done now rather than on the first requests.
+
+        Args:
+            ref_codes (np.ndarray | torch.tensor): Encoded reference.
+            ref_text (str): Reference text for reference audio.
+            max_batch_size (int): Largest batch size `infer_batch` will be called with.
+            n_tokens (int): Number of tokens to generate.
+        """
+        if self._is_quantized_model:
+            return
+
+        prompt_ids = self._apply_chat_template(ref_codes, ref_text, "Warming up.")
+        stopping_criteria = StoppingCriteriaList([_StopAfterNewTokens(len(prompt_ids), n_tokens)])
+        for batch_size in range(1, max_batch_size + 1):
+            if batch_size == 1:
+                # Same call shape as `_infer_torch`
+                input_ids = torch.tensor(prompt_ids).unsqueeze(0)
+                batch_kwargs = {}
+            else:
+                # Same call shape as `_infer_torch_batch`
+                input_ids, attention_mask, pad_id = self._left_pad([prompt_ids] * batch_size)
+                batch_kwargs = {
+                    "attention_mask": attention_mask.to(self.backbone.device),
+                    "pad_token_id": pad_id,
+                }
+            with self._generate_lock, torch.inference_mode(), self._autocast():
+                self.backbone.generate(
+                    input_ids.to(self.backbone.device),
+                    max_length=self.max_context,
+                    do_sample=True,
+                    temperature=1.0,
+                    top_k=50,
+                    use_cache=True,
+                    stopping_criteria=stopping_criteria,
+                    **batch_kwargs,
+                )
+
+    def build_prefix_cache(self, ref_text: str) -> dict | None:
+        """
+        Prefill the backbone on the reference part of the prompt so that requests using
+        this reference only prefill their own text.
+
+        Args:
+            ref_text (str): Reference text for reference audio.
+        Returns:
+            dict | None: Prefix token ids and their `past_key_values`, or None when the
+            backbone cannot reuse a prefix (GGUF backbone, static-cache generation or
+            speculative decoding with a draft model).
+        """
+        if (
+            self._is_quantized_model
+            or self.draft is not None
+            or self.backbone.generation_config.cache_implementation == "static"
+        ):
+            return None
+
+        prefix_ids = self._prompt_prefix_ids(ref_text)
+        prefix_tensor = torch.tensor(prefix_ids).unsqueeze(0).to(self.backbone.device)
+        with self._generate_lock, torch.inference_mode(), self._autocast():
+            past_key_values = self.backbone(prefix_tensor, use_cache=True).past_key_values
+        return {"ids": prefix_ids, "past_key_values": past_key_values}
 
     def _decode(self, codes: str):
 
@@ -215,14 +548,19 @@ class NeuTTSAir:
 
         if len(speech_ids) > 0:
 
+            # Onnx Runtime decode
+            if self.codec_decoder is not None:
+                codes = np.array(speech_ids, dtype=np.int32)[np.newaxis, np.newaxis, :]
+                recon = self.codec_decoder.run(None, {self._codec_decoder_input: codes})[0]
+
             # Onnx decode
-            if self._is_onnx_codec:
+            elif self._is_onnx_codec:
                 codes = np.array(speech_ids, dtype=np.int32)[np.newaxis, np.newaxis, :]
                 recon = self.codec.decode_code(codes)
 
             # Torch decode
             else:
-                with torch.no_grad():
+                with torch.inference_mode():
                     codes = torch.tensor(speech_ids, dtype=torch.long)[None, None, :].to(
                         self.codec.device
                     )
@@ -238,25 +576,33 @@ class NeuTTSAir:
         phones = " ".join(phones)
         return phones
 
+    def _prompt_prefix_ids(self, ref_text: str) -> list[int]:
+        # Prompt tokens up to the end of the reference phonemes; identical for every request
+        # using this reference, so their KV cache can be computed once (see build_prefix_cache)
+        text_replace = self.tokenizer.convert_tokens_to_ids("<|TEXT_REPLACE|>")
+        text_prompt_start = self.tokenizer.convert_tokens_to_ids("<|TEXT_PROMPT_START|>")
+
+        ids = self.tokenizer.encode(_CHAT_TEMPLATE)
+        text_replace_idx = ids.index(text_replace)
+        ref_ids = self.tokenizer.encode(self._to_phones(ref_text), add_special_tokens=False)
+
+        return ids[:text_replace_idx] + [text_prompt_start] + ref_ids
+
     def _apply_chat_template(
         self, ref_codes: list[int], ref_text: str, input_text: str
     ) -> list[int]:
 
-        input_text = self._to_phones(ref_text) + " " + self._to_phones(input_text)
         speech_replace = self.tokenizer.convert_tokens_to_ids("<|SPEECH_REPLACE|>")
         speech_gen_start = self.tokenizer.convert_tokens_to_ids("<|SPEECH_GENERATION_START|>")
         text_replace = self.tokenizer.convert_tokens_to_ids("<|TEXT_REPLACE|>")
-        text_prompt_start = self.tokenizer.convert_tokens_to_ids("<|TEXT_PROMPT_START|>")
         text_prompt_end = self.tokenizer.convert_tokens_to_ids("<|TEXT_PROMPT_END|>")
 
-        input_ids = self.tokenizer.encode(input_text, add_special_tokens=False)
-        chat = """user: Convert the text to speech:<|TEXT_REPLACE|>\nassistant:<|SPEECH_REPLACE|>"""
-        ids = self.tokenizer.encode(chat)
+        input_ids = self.tokenizer.encode(" " + self._to_phones(input_text), add_special_tokens=False)
+        ids = self.tokenizer.encode(_CHAT_TEMPLATE)
 
         text_replace_idx = ids.index(text_replace)
         ids = (
-            ids[:text_replace_idx]
-            + [text_prompt_start]
+            self._prompt_prefix_ids(ref_text)
             + input_ids
             + [text_prompt_end]
             + ids[text_replace_idx + 1 :]  # noqa
@@ -269,10 +615,29 @@ class NeuTTSAir:
 
         return ids
 
-    def _infer_torch(self, prompt_ids: list[int]) -> str:
+    def _autocast(self):
+        # Keeps precision-sensitive ops (norms, softmax) in FP32 when the weights are reduced precision
+        return torch.autocast(
+            device_type=self.backbone.device.type,
+            dtype=self.backbone.dtype,
+            enabled=self.backbone.dtype != torch.float32,
+        )
+
+    def _draft_kwargs(self) -> dict:
+        if self.draft is None:
+            return {}
+        return {"assistant_model": self.draft}
+
+    def _prefix_cache_kwargs(self, prompt_ids: list[int], prefix_cache: dict | None) -> dict:
+        if prefix_cache is None or prompt_ids[: len(prefix_cache["ids"])] != prefix_cache["ids"]:
+            return {}
+        # generate() extends the cache in place, so every request works on its own copy
+        return {"past_key_values": copy.deepcopy(prefix_cache["past_key_values"])}
+
+    def _infer_torch(self, prompt_ids: list[int], prefix_cache: dict | None = None) -> str:
         prompt_tensor = torch.tensor(prompt_ids).unsqueeze(0).to(self.backbone.device)
         speech_end_id = self.tokenizer.convert_tokens_to_ids("<|SPEECH_GENERATION_END|>")
-        with torch.no_grad():
+        with self._generate_lock, torch.inference_mode(), self._autocast():
             output_tokens = self.backbone.generate(
                 prompt_tensor,
                 max_length=self.max_context,
@@ -282,13 +647,55 @@ class NeuTTSAir:
                 top_k=50,
                 use_cache=True,
                 min_new_tokens=50,
+                **self._prefix_cache_kwargs(prompt_ids, prefix_cache),
+                **self._draft_kwargs(),
             )
         input_length = prompt_tensor.shape[-1]
         output_str = self.tokenizer.decode(
             output_tokens[0, input_length:].cpu().numpy().tolist(), add_special_tokens=False
         )
         return output_str
-    
+
+    def _left_pad(self, prompts: list[list[int]]) -> tuple[torch.Tensor, torch.Tensor, int]:
+        pad_id = self.tokenizer.pad_token_id
+        if pad_id is None:
+            pad_id = self.tokenizer.convert_tokens_to_ids("<|SPEECH_GENERATION_END|>")
+
+        # Left-pad so every prompt ends where generation starts
+        input_length = max(len(ids) for ids in prompts)
+        input_ids = torch.full((len(prompts), input_length), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(prompts), input_length), dtype=torch.long)
+        for row, ids in enumerate(prompts):
+            input_ids[row, input_length - len(ids):] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, input_length - len(ids):] = 1
+        return input_ids, attention_mask, pad_id
+
+    def _infer_torch_batch(self, prompts: list[list[int]], prefix_cache: dict | None = None) -> list[str]:
+        if len(prompts) == 1:
+            return [self._infer_torch(prompts[0], prefix_cache)]
+
+        speech_end_id = self.tokenizer.convert_tokens_to_ids("<|SPEECH_GENERATION_END|>")
+        input_ids, attention_mask, pad_id = self._left_pad(prompts)
+        input_length = input_ids.shape[-1]
+
+        with self._generate_lock, torch.inference_mode(), self._autocast():
+            output_tokens = self.backbone.generate(
+                input_ids.to(self.backbone.device),
+                attention_mask=attention_mask.to(self.backbone.device),
+                max_length=self.max_context,
+                eos_token_id=speech_end_id,
+                pad_token_id=pad_id,
+                do_sample=True,
+                temperature=1.0,
+                top_k=50,
+                use_cache=True,
+                min_new_tokens=50,
+            )
+        output_tokens = output_tokens[:, input_length:].cpu().numpy().tolist()
+        return [
+            self.tokenizer.decode(tokens, add_special_tokens=False) for tokens in output_tokens
+        ]
+
     def _infer_ggml(self, ref_codes: list[int], ref_text: str, input_text: str) -> str:
         ref_text = self._to_phones(ref_text)
         input_text = self._to_phones(input_text)
@@ -318,20 +725,85 @@ class NeuTTSAir:
             f"<|TEXT_PROMPT_END|>\nassistant:<|SPEECH_GENERATION_START|>{codes_str}"
         )
 
+        tokens = (
+            item["choices"][0]["text"]
+            for item in self.backbone(
+                prompt,
+                max_tokens=self.max_context,
+                temperature=1.0,
+                top_k=50,
+                stop=["<|SPEECH_GENERATION_END|>"],
+                stream=True
+            )
+        )
+        yield from self._decode_stream(tokens, ref_codes)
+
+    def _infer_stream_torch(
+        self,
+        ref_codes: torch.Tensor,
+        ref_text: str,
+        input_text: str,
+        prefix_cache: dict | None = None,
+        stop_event: Event | None = None,
+        executor: Executor | None = None,
+    ) -> Generator[np.ndarray, None, None]:
+        prompt_ids = self._apply_chat_template(ref_codes, ref_text, input_text)
+        prompt_tensor = torch.tensor(prompt_ids).unsqueeze(0).to(self.backbone.device)
+        speech_end_id = self.tokenizer.convert_tokens_to_ids("<|SPEECH_GENERATION_END|>")
+        streamer = _TokenIteratorStreamer(self.tokenizer)
+        generate_kwargs = self._prefix_cache_kwargs(prompt_ids, prefix_cache)
+        if stop_event is None:
+            stop_event = Event()
+
+        def _generate():
+            try:
+                with self._generate_lock:
+                    # The consumer may have gone away while waiting for another generation
+                    if stop_event.is_set():
+                        streamer.end()
+                        return
+                    with torch.inference_mode(), self._autocast():
+                        self.backbone.generate(
+                            prompt_tensor,
+                            max_length=self.max_context,
+                            eos_token_id=speech_end_id,
+                            do_sample=True,
+                            temperature=1.0,
+                            top_k=50,
+                            use_cache=True,
+                            min_new_tokens=50,
+                            streamer=streamer,
+                            stopping_criteria=StoppingCriteriaList([_StopOnEvent(stop_event)]),
+                            **generate_kwargs,
+                            **self._draft_kwargs(),
+                        )
+            except Exception as e:
+                streamer.error(e)
+
+        def _end_if_cancelled(future):
+            # A generation cancelled before it started (e.g. on executor shutdown) never ends the stream itself
+            if future.cancelled():
+                streamer.end()
+
+        if executor is None:
+            Thread(target=_generate, daemon=True).start()
+        else:
+            executor.submit(_generate).add_done_callback(_end_if_cancelled)
+
+        try:
+            tokens = (token for token in streamer if token != "<|SPEECH_GENERATION_END|>")
+            yield from self._decode_stream(tokens, ref_codes)
+        finally:
+            # Closing the stream early stops the backbone at its next token
+            stop_event.set()
+
+    def _decode_stream(self, tokens: Iterable[str], ref_codes: torch.Tensor) -> Generator[np.ndarray, None, None]:
         audio_cache: list[np.ndarray] = []
         token_cache: list[str] = [f"<|speech_{idx}|>" for idx in ref_codes]
         n_decoded_samples: int = 0
         n_decoded_tokens: int = len(ref_codes)
 
-        for item in self.backbone(
-            prompt,
-            max_tokens=self.max_context,
-            temperature=1.0,
-            top_k=50,
-            stop=["<|SPEECH_GENERATION_END|>"],
-            stream=True
-        ):
-            output_str = item["choices"][0]["text"]
+        for output_str in tokens:
             token_cache.append(output_str)
 
             if len(token_cache[n_decoded_tokens:]) >= self.streaming_frames_per_chunk + self.streaming_lookforward:
@@ -1,11 +1,13 @@
 # save_models.py
 import torch
+from huggingface_hub import snapshot_download
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from neucodec import NeuCodec
 
 # --- Configuration ---
 BACKBONE_REPO = "neuphonic/neutts-air"
 CODEC_REPO = "neuphonic/neucodec"
+CODEC_DECODER_REPO = "neuphonic/neucodec-onnx-decoder"
 SAVE_DIR = "./local_models"
 
 # --- 1. Save the Backbone Model and Tokenizer ---
@@ -14,7 +16,8 @@ backbone = AutoModelForCausalLM.from_pretrained(BACKBONE_REPO)
 tokenizer = AutoTokenizer.from_pretrained(BACKBONE_REPO)
 
 print(f"Saving backbone and tokenizer to '{SAVE_DIR}/backbone/'...")
-backbone.save_pretrained(f"{SAVE_DIR}/backbone")
+# safetensors can be memory-mapped at load time, so server workers share the weight pages
+backbone.save_pretrained(f"{SAVE_DIR}/backbone", safe_serialization=True)
 tokenizer.save_pretrained(f"{SAVE_DIR}/backbone")
 print("Backbone saved successfully!")
 
@@ -25,4 +28,14 @@ codec = NeuCodec.from_pretrained(CODEC_REPO)
 print(f"Saving codec state_dict to '{SAVE_DIR}/codec.pt'...")
 # We save the state_dict, which contains all the learned weights
 torch.save(codec.state_dict(), f"{SAVE_DIR}/codec.pt")
-print("Codec saved successfully!")
\ No newline at end of file
+print("Codec saved successfully!")
+
+# --- 3. Save the ONNX Codec Decoder ---
+print(f"\nDownloading ONNX codec decoder from '{CODEC_DECODER_REPO}'...")
+# Used on CPU to decode speech tokens with ONNX Runtime; the torch codec above still encodes references
+snapshot_download(
+    repo_id=CODEC_DECODER_REPO,
+    allow_patterns=["*.onnx"],
+    local_dir=f"{SAVE_DIR}/codec_decoder",
+)
+print("ONNX codec decoder saved successfully!")